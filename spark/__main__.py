@@ -1,35 +1,36 @@
 #!/usr/bin/env python3
-import argparse
-import platform
 import sys
-import tomllib
 
 import codes
-from project import init_new_project
 from lib import perror
 
-SPARK_MINIMAL_PYTHON_VERSION = "3.10.0"
+SPARK_MINIMAL_PYTHON_VERSION = (3, 10, 0)
 
 
 def load_sparkfile() -> dict:
+    import tomllib  # Imported lazily to keep the startup of the CLI fast.
     try:
-        with open("Spark.toml", 'r') as sparkfile:
-            return tomllib.loads(sparkfile.read())
+        with open("Spark.toml", 'rb') as sparkfile:
+            return tomllib.load(sparkfile)
     except OSError as e:
         perror("can't open Spark.toml", e, codes.EXIT_SPARKFILE_UNAVAILABLE)
 
 
 def main(argv: list[str]) -> None:
-    if platform.python_version() < SPARK_MINIMAL_PYTHON_VERSION:
+    # Comparing version strings is lexicographic and would consider 3.9 newer than 3.10, so we compare tuples.
+    if sys.version_info < SPARK_MINIMAL_PYTHON_VERSION:
+        import platform
         sys.stderr.write("spark: You are running Spark in an unsupported version of Python. Spark requires " +
-                         "Python " + SPARK_MINIMAL_PYTHON_VERSION + " and you are running Python " +
-                         platform.python_version() + ".")
+                         "Python " + ".".join(map(str, SPARK_MINIMAL_PYTHON_VERSION)) + " and you are running " +
+                         "Python " + platform.python_version() + ".")
         sys.exit(codes.EXIT_UNSUPPORTED_PYTHON_VERSION)
 
+    import argparse
     parser = argparse.ArgumentParser(prog="spark", description="A declarative build system for C and C++ projects")
     parser.add_argument("--new", dest="title", type=str, help="Specifies the name of new Spark project to create.")
     args = parser.parse_args(argv)
     if args.title:
+        from project import init_new_project
         init_new_project(args.title)
 
     spark_build_declaration: dict = load_sparkfile()
@@ -1,8 +1,11 @@
 import os
 import sys
+import time
+import heapq
 import shutil
+import selectors
+import threading
 import subprocess
-from collections import deque
 from typing import Self, Iterable
 
 import psutil
@@ -12,6 +15,54 @@ from spark.lib import perror, tee
 from spark.destinations import get_build_logging_path
 
 
+def is_pidfd_supported() -> bool:
+    """Tells if the host can open file descriptors referring to processes (pidfds). They are only
+       available on Linux 5.3 and newer, but allow waiting for the children of the executor alone with
+       a selector, rather than reaping any child of the process, including those spawned by others.
+       :return True if os.pidfd_open() works on this system, and False otherwise."""
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+PIDFD_SUPPORTED: bool = is_pidfd_supported()
+
+# Compilers mostly peak at the number of physical cores, since hyper-threads share the front-end of their
+# core, so it's what we run by default. psutil reads it from the filesystem, so we only ask for it once.
+DEFAULT_JOBS: int = psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+
+# The extensions of C and C++ translation units. They identify which argument of the subcommand is the source
+# file being compiled, and we estimate how long the subcommand takes to run by it.
+SOURCE_FILE_EXTENSIONS = frozenset({".c", ".cc", ".cpp", ".cxx", ".c++", ".C", ".m", ".mm"})
+
+# How long compiling a byte of source takes, when we can't learn it from the timings of a previous build. It's roughly
+# 10 KB of source a second, and without any timings it only matters that it orders the sources by their size.
+DEFAULT_SECONDS_PER_BYTE: float = 1e-4
+
+
+def get_subcommand_source(subcommand: list[str]) -> str | None:
+    """Finds the source file the subcommand compiles.
+       :param subcommand The list of command-line arguments of the subcommand.
+       :return The first argument that is a C or C++ source file, or None if there is none, such as when linking."""
+    for argument in subcommand:
+        if os.path.splitext(argument)[1] in SOURCE_FILE_EXTENSIONS:
+            return argument
+    return None
+
+
+# The kernel only recomputes the load average every 5 seconds, so there is no point in asking for it more often.
+LOAD_AVERAGE_UPDATE_INTERVAL_SECONDS: float = 5.0
+
+# How long to wait for the output of the build to be written out once it's over. The output only ends when
+# every process holding the pipe exits, which might never happen if some subcommand left a daemon behind.
+OUTPUT_DRAIN_TIMEOUT_SECONDS: float = 5.0
+
+# How long the running processes have to exit after they're asked to terminate before they're killed.
+TERMINATION_TIMEOUT_SECONDS: float = 2.0
+
+
 def get_recent_load_average() -> float:
     """Retrieves the load average for the last minute. On Unix-like operating systems, the
        kernel itself keeps trek of load average and could be retrieved with os.getloadavg(),
@@ -41,23 +92,43 @@ class BuildProcessExecutor:
        ProcessPoolExecutor, which, however, dynamically spawns more processes to complete all submitted
        work and can start external commands, such as compilers or scripts."""
 
-    def __init__(self, total: int, jobs: float = None, load_average: float = None):
+    def __init__(self, total: int, jobs: float = None, load_average: float = None,
+                 timings: dict[str, float] = None, quiet: bool = False):
         """Initialises a new process executor.
            :param total The total number of build processes that will be executed by the executor.
            It's used in printing the counter of [current/total] steps, similarly to how Ninja does.
            :param jobs (optional) The number of parallel builder tasks (jobs) to run.
-           Defaults to the number of threads on the host machine.
+           Defaults to the number of physical cores on the host machine.
            :param load_average (optional) The maximum load average to balance. If load average in the
            las minute crosses this value, Spark will drop and run less builder processes to balance
-           the load on the system. This value is ignored on Windows since there is no load average on it."""
+           the load on the system. This value is ignored on Windows since there is no load average on it.
+           :param timings (optional) The wall time in seconds it took to build each source file the last time,
+           as recorded in the timings attribute after a previous build. It's used to start the longest
+           subcommands first so that they don't end up running alone at the end of the build. It's up to
+           the caller to persist the timings between builds, for example in the SparkCacheFile.
+           :param quiet (optional) Whether to suppress the [current/total] line printed for every subcommand."""
         self.total = total
-        self.jobs = jobs if jobs is not None else psutil.cpu_count()
+        self.quiet = quiet
+        self.jobs = jobs if jobs is not None else DEFAULT_JOBS
         self.load_average = load_average if load_average is not None else self.jobs
         self.streams = (os.dup(sys.stdout.fileno()), os.dup(sys.stderr.fileno()))
         self.processes: dict[int, subprocess.Popen] = {}
-        self.subcommands: deque[list[str]] = deque()
-        self.tee: subprocess.Popen | None = None
+        # The submitted subcommands form a heap ordered by their estimated cost in descending order, and the
+        # sequence number keeps the submission order among subcommands with the same cost.
+        self.subcommands: list[tuple[float, int, list[str]]] = []
+        self.sequence = 0
+        self.timings: dict[str, float] = timings if timings is not None else {}
+        # Learned from the timings we were given once the first source without a timing is submitted.
+        self.seconds_per_byte: float | None = None
+        self.spawn_times: dict[int, tuple[str, float]] = {}
+        # The absolute paths of the programs we've already looked up in PATH.
+        self.executables: dict[str, str] = {}
+        self.tee: threading.Thread | None = None
+        # Where pidfds are available, each running process is registered in the selector with its pid as data.
+        self.selector = selectors.DefaultSelector() if PIDFD_SUPPORTED else None
         self.running_jobs = self.jobs
+        self.recent_load_average = 0.0
+        self.load_average_timestamp = -LOAD_AVERAGE_UPDATE_INTERVAL_SECONDS
         self.counter = 0
 
     def __enter__(self) -> Self:
@@ -65,24 +136,33 @@ class BuildProcessExecutor:
            the whole standard output, including any child process output such as compiler
            warnings or script output as well, we need to create a pipe where the whole
            output goes and set the stdout and stderr file descriptors to it. The pipe is
-           then read by spark.lib.tee module that in turn runs as a separate process and
-           writes the pipe contents to both in-terminal standard output and the log file.
+           then read by a background thread running spark.lib.tee.pump() that writes the
+           pipe contents to both in-terminal standard output and the log file.
            :return Reference to self to enter the context."""
-        python_executable = sys.executable or shutil.which("python3")
-        tee_process_subcommand = [python_executable, tee.__file__, str(get_build_logging_path())]
-        self.tee = subprocess.Popen(tee_process_subcommand, stdin=subprocess.PIPE)
-        os.dup2(self.tee.stdin.fileno(), sys.stdout.fileno())
-        os.dup2(self.tee.stdin.fileno(), sys.stderr.fileno())
+        log_path = get_build_logging_path()
+        os.makedirs(log_path.parent, exist_ok=True)
+        log = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        read_end, write_end = os.pipe()
+        os.dup2(write_end, sys.stdout.fileno())
+        os.dup2(write_end, sys.stderr.fileno())
+        os.close(write_end)
+        self.tee = threading.Thread(target=self.__pump_output, args=(read_end, log), daemon=True)
+        self.tee.start()
         return self
 
+    def __pump_output(self, read_end: int, log: int) -> None:
+        """Copies the build output to the terminal and the log file until the pipe is closed."""
+        try:
+            tee.pump(read_end, self.streams[0], log)
+        finally:
+            os.close(read_end)
+            os.close(log)
+
     def __exit__(self, exc_type, exc_val: Exception, traceback: str) -> None:
         # If we didn't start tasks in the body of the context manager, we should start
         # them here and guarantee all tasks complete when the executor finishes.
         self.__finish_all_tasks()
         self.shutdown()
-        # Now we need to restore the original file descriptors since the build process is over.
-        os.dup2(self.streams[0], sys.stdout.fileno())
-        os.dup2(self.streams[1], sys.stderr.fileno())
         # We ignore ValueError because it's caused by the caller submitting not valid subcommand.
         if exc_type is not None and exc_type != ValueError:
             handle_subcommand_failure()
@@ -96,7 +176,40 @@ class BuildProcessExecutor:
            often rely on these arguments to tell all information they need. It is, however, possible to
            not specify this argument if the executable does not accept any arguments, such as ldconfig(8).
            This list should not contain the executable itself but only the arguments that come after it."""
-        self.subcommands.appendleft(subcommand)
+        heapq.heappush(self.subcommands, (-self.estimate_cost(subcommand), self.sequence, subcommand))
+        self.sequence += 1
+
+    def estimate_cost(self, subcommand: list[str]) -> float:
+        """Estimates how long the subcommand takes to run in seconds. If we've built its source file before,
+           it's the wall time it took, otherwise the size of the source file is converted to the time it would
+           take to compile at the rate the timed sources were compiled at.
+           :param subcommand The list of command-line arguments of the subcommand.
+           :return The estimated cost of the subcommand, or 0 if it doesn't compile any source file."""
+        source = get_subcommand_source(subcommand)
+        if source is None:
+            return 0.0
+        if source in self.timings:
+            return self.timings[source]
+        try:
+            return os.path.getsize(source) * self.__get_seconds_per_byte()
+        except OSError:
+            return 0.0
+
+    def __get_seconds_per_byte(self) -> float:
+        """Finds how long compiling a byte of source takes from the timings of the previous build, which is only
+           done once, since the sizes of all the timed sources have to be read for it.
+           :return The total wall time of the timed sources divided by their total size, or the default rate if
+           none of them can be found anymore."""
+        if self.seconds_per_byte is None:
+            seconds, size = 0.0, 0
+            for source, timing in self.timings.items():
+                try:
+                    size += os.path.getsize(source)
+                except OSError:
+                    continue
+                seconds += timing
+            self.seconds_per_byte = seconds / size if seconds > 0 and size > 0 else DEFAULT_SECONDS_PER_BYTE
+        return self.seconds_per_byte
 
     def progress(self) -> tuple[int, int]:
         """Reports the number of spawned processes and the total."""
@@ -106,6 +219,29 @@ class BuildProcessExecutor:
         """Tells if the executor completed all submitted tasks."""
         return not self.processes and not self.subcommands
 
+    def __next_subcommand(self) -> list[str]:
+        """Takes the next subcommand to run. Normally, it's the longest one, because the short subcommands
+           are best to fill the gaps at the end of the build. When the system is overloaded and we dropped
+           to a single job, however, we take the shortest subcommand to clear the queue the fastest."""
+        if self.running_jobs == self.jobs:
+            return heapq.heappop(self.subcommands)[2]
+        shortest = max(self.subcommands)
+        self.subcommands.remove(shortest)
+        heapq.heapify(self.subcommands)
+        return shortest[2]
+
+    def resolve_executable(self, program: str) -> str:
+        """Finds the absolute path of the program the subcommand runs. It's looked up in PATH only once per
+           program, and the absolute path lets subprocess start the process with posix_spawn() instead of fork().
+           :param program The first argument of the subcommand, the name or path of the program to run.
+           :return The absolute path of the program, or the program itself if it couldn't be found, in which
+           case starting it fails the same way it would without the lookup."""
+        executable = self.executables.get(program)
+        if executable is None:
+            executable = shutil.which(program) or program
+            self.executables[program] = executable
+        return executable
+
     def start(self) -> None:
         """Spawns the builder processes to fill the vacant threads. This method will check the appropriate
            number of additional (vacant) processes that need to be spawned and log the subcommand invocation
@@ -113,41 +249,98 @@ class BuildProcessExecutor:
         if len(self.processes) > self.jobs:
             return
 
-        loadavg: float = get_recent_load_average()
-        self.running_jobs = 1 if loadavg > self.load_average else self.jobs
+        now = time.monotonic()
+        if now - self.load_average_timestamp >= LOAD_AVERAGE_UPDATE_INTERVAL_SECONDS:
+            self.recent_load_average = get_recent_load_average()
+            self.load_average_timestamp = now
+        self.running_jobs = 1 if self.recent_load_average > self.load_average else self.jobs
 
         available_subcommands = len(self.subcommands)
         vacant_process_difference = self.running_jobs - len(self.processes)
         additional_builder_jobs = vacant_process_difference \
             if vacant_process_difference <= available_subcommands else available_subcommands
-        try:
-            for _ in range(additional_builder_jobs):
-                self.counter += 1
-                subcommand: list[str] = self.subcommands.pop()
-                print(f"[{self.counter}/{self.total}] {" ".join(subcommand)}")
-                process = subprocess.Popen(subcommand)
-                self.processes[process.pid] = process
-        except OSError as e:
-            perror("subcommand could not be started", e, codes.EXIT_NO_SUCH_SUBCOMMAND)
-            self.shutdown()
+        for _ in range(additional_builder_jobs):
+            self.counter += 1
+            subcommand: list[str] = self.__next_subcommand()
+            # All descriptors we open are not inheritable anyway, so there is no need to close them in
+            # the child, and without it subprocess can use posix_spawn() instead of forking the interpreter.
+            executable = self.resolve_executable(subcommand[0])
+            try:
+                process = subprocess.Popen(subcommand, executable=executable, close_fds=False)
+            except OSError as e:
+                perror(f"subcommand {subcommand[0]} could not be started", e, codes.EXIT_NO_SUCH_SUBCOMMAND)
+                self.shutdown()
+                break
+            self.processes[process.pid] = process
+            source = get_subcommand_source(subcommand)
+            if source is not None:
+                self.spawn_times[process.pid] = (source, time.monotonic())
+            if self.selector is not None:
+                try:
+                    pidfd = os.pidfd_open(process.pid)
+                except OSError as e:
+                    # The subcommand is already running, but we would never learn when it completes, so it's
+                    # terminated along with the rest before we exit.
+                    self.shutdown()
+                    perror(f"subcommand {subcommand[0]} could not be waited for", e, codes.EXIT_INTERNAL_SPARK_ERROR)
+                    break
+                self.selector.register(pidfd, selectors.EVENT_READ, process.pid)
+            # The status line is only formatted once the process is running, so that it starts sooner,
+            # and it's flushed once for all the processes we spawn.
+            if not self.quiet:
+                sys.stdout.write(f"[{self.counter}/{self.total}] {' '.join(subcommand)}\n")
+        if not self.quiet:
+            sys.stdout.flush()
+
+    def __wait(self) -> list[tuple[int, int]]:
+        """Blocks until any of the running processes completes and reaps it, along with all other processes
+           that have completed by then, since compilers often finish close together. With pidfds, we only wait
+           for the processes of this executor, otherwise we wait for any child process to terminate.
+           :return The process IDs and the statuses as returned by os.waitpid()."""
+        if self.selector is None:
+            completed = [os.waitpid(-1, 0)]
+            while True:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if pid == 0:
+                    break
+                completed.append((pid, status))
+            return completed
+        while True:
+            events = self.selector.select()
+            for key, _ in events:
+                self.selector.unregister(key.fileobj)
+                os.close(key.fd)
+            if events:
+                return [os.waitpid(key.data, 0) for key, _ in events]
 
     def as_completed(self) -> Iterable[tuple[int, int]]:
-        """Yields the process ID and the exit code of each process as it completes."""
+        """Yields the process ID and the exit code of each process as it completes. As soon as processes
+           complete, their slots are refilled with the next submitted subcommands before the results are
+           yielded, so the iteration goes on until all submitted subcommands are complete."""
         self.start()
         while self.processes:
             try:
-                pid, status = os.waitpid(-1, 0)
+                completed = self.__wait()
+            except ChildProcessError:
+                return
+            results = []
+            for pid, status in completed:
                 # The status variable, depending on the OS, could include more information than just
                 # the exit code. On Unix, it returns the mask where the lower 8 bits are the exit code,
                 # and on Windows it returns the exit code only. To make it easier to extract the exit
                 # code alone, on Windows os.waitpid() returns the status shifted by 8 bits so that you
                 # could shift it back and get the exit code regardless of your OS. For more details, refer
                 # to the Python documentation: https://docs.python.org/3/library/os.html#os.waitpid
-                result = (pid, status >> 8)
+                results.append((pid, status >> 8))
                 del self.processes[pid]
-                yield result
-            except ChildProcessError:
-                return
+                if pid in self.spawn_times:
+                    source, spawn_time = self.spawn_times.pop(pid)
+                    self.timings[source] = time.monotonic() - spawn_time
+            self.start()
+            yield from results
 
     def __finish_all_tasks(self) -> None:
         """Runs all tasks submitted to the executor until they are exhausted."""
@@ -157,11 +350,33 @@ class BuildProcessExecutor:
     def shutdown(self) -> None:
         """Terminates all running processes within the executor, usually in response to error."""
         self.subcommands.clear()
-        if self.tee is not None:
-            sys.stdout.buffer.write(tee.EOF)
-            sys.stdout.buffer.flush()
-            self.tee.wait()
-        for pid, process in self.processes.items():
+        # All processes are asked to terminate first so that they shut down at the same time, and then
+        # all share the same deadline, after which the remaining ones are killed.
+        processes = list(self.processes.values())
+        for process in processes:
             process.terminate()
-            process.wait()
+        deadline = time.monotonic() + TERMINATION_TIMEOUT_SECONDS
+        for process in processes:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
         self.processes.clear()
+        self.spawn_times.clear()
+        if self.selector is not None:
+            for key in list(self.selector.get_map().values()):
+                self.selector.unregister(key.fileobj)
+                os.close(key.fd)
+            # The selector holds a descriptor of its own, such as the epoll instance on Linux.
+            self.selector.close()
+            self.selector = None
+        if self.tee is not None:
+            # Restoring the original file descriptors closes our write ends of the pipe, and since all
+            # children are gone by now, the tee thread reaches the end of the output and finishes.
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(self.streams[0], sys.stdout.fileno())
+            os.dup2(self.streams[1], sys.stderr.fileno())
+            self.tee.join(OUTPUT_DRAIN_TIMEOUT_SECONDS)
+            self.tee = None
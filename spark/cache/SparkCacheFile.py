@@ -1,17 +1,22 @@
 import os
 import sys
+import mmap
 import pickle
+import struct
 import tomllib
 import getpass
+import tempfile
+import functools
 from pathlib import Path
 from typing import Self, Any
 
 import keyring as kr
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 
 from spark import SPARK_BUILD_DECLARATION_FILES
 from spark import codes
-from spark import destinations
 from spark.cache import crypto
+from spark.lib import writev_fully
 from spark.destinations import get_temporary_cache_path, get_public_cache_key_path
 
 # The cache files can only be accessed by the owner. The permission mask includes the execute bit
@@ -19,6 +24,65 @@ from spark.destinations import get_temporary_cache_path, get_public_cache_key_pa
 # new files in it. For more details, refer to https://askubuntu.com/a/1244013.
 OWNER_READ_AND_WRITE_ONLY_PERMISSION_MASK: int = 0o700
 
+# The cache is serialised with the newest pickle protocol, which is both faster and more compact than the default.
+# Formats like msgpack or JSON can't round-trip the datetime values TOML allows, so pickle remains our format.
+PICKLE_PROTOCOL: int = pickle.HIGHEST_PROTOCOL
+
+# Parsed build declarations keyed by the file path, its modification time in nanoseconds and its size.
+# The declaration files rarely change between regenerations, so we only pay for tomllib once per version.
+_PARSED_TOML_CACHE: dict[tuple[str, int, int], dict[str, Any]] = {}
+
+# The cache file starts with the fingerprints of the declaration files it was generated from, that is, the
+# modification time in nanoseconds and the size of each file (or -1 for both if the file doesn't exist).
+# If they still match the files on disk, the cache is up-to-date and doesn't need to be regenerated.
+DECLARATION_FINGERPRINTS_FORMAT: str = f"<{2 * len(SPARK_BUILD_DECLARATION_FILES)}q"
+DECLARATION_FINGERPRINTS_SIZE_BYTES: int = struct.calcsize(DECLARATION_FINGERPRINTS_FORMAT)
+
+# The offset of the pickled payload in the cache file that follows the fingerprints and the signature.
+PAYLOAD_OFFSET_BYTES: int = DECLARATION_FINGERPRINTS_SIZE_BYTES + crypto.SIGNATURE_SIZE_BYTES
+
+# The cache file is read on every invocation, and there is no use in updating its access time every time, so we ask
+# the kernel not to where we can (Linux only). O_BINARY only exists on Windows, where it disables newline translation.
+CACHE_FILE_READ_FLAGS: int = os.O_RDONLY | getattr(os, "O_NOATIME", 0) | getattr(os, "O_BINARY", 0)
+
+
+def _parse_toml_cached(path: Path, mtime_ns: int, size: int) -> dict[str, Any]:
+    """Parses the build declaration file, reusing the previous result if the file hasn't changed since.
+       The returned dictionary is shared between callers and must not be mutated.
+       :param path The path to the TOML file to parse.
+       :param mtime_ns The modification time of the file in nanoseconds as reported by os.stat().
+       :param size The size of the file in bytes as reported by os.stat().
+       :return The parsed declaration."""
+    # The declaration files are found relative to the working directory, which may change between calls.
+    key = (os.path.abspath(path), mtime_ns, size)
+    parsed_declaration = _PARSED_TOML_CACHE.get(key)
+    if parsed_declaration is None:
+        with open(path, "rb") as declaration_file:
+            parsed_declaration = tomllib.load(declaration_file)
+        _PARSED_TOML_CACHE[key] = parsed_declaration
+    return parsed_declaration
+
+
+def _stat_declarations() -> list[tuple[int, int]]:
+    """Stats every build declaration file. Symbolic links are followed, since it's the contents of the
+       file they point to that make up the build configuration.
+       :return The modification time in nanoseconds and the size of each declaration file in the order
+       of SPARK_BUILD_DECLARATION_FILES, or (-1, -1) for the files that don't exist."""
+    fingerprints: list[tuple[int, int]] = []
+    for declaration in SPARK_BUILD_DECLARATION_FILES:
+        try:
+            stat = os.stat(declaration)
+            fingerprints.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            fingerprints.append((-1, -1))
+    return fingerprints
+
+
+def _pack_fingerprints(fingerprints: list[tuple[int, int]]) -> bytes:
+    """Packs the fingerprints returned by _stat_declarations() as stored at the head of the cache file."""
+    fields = [field for fingerprint in fingerprints for field in fingerprint]
+    return struct.pack(DECLARATION_FINGERPRINTS_FORMAT, *fields)
+
 
 class SparkCacheFile:
     """Spark cache file that encapsulates pre-processed data to avoid parsing and reading all
@@ -32,20 +96,33 @@ class SparkCacheFile:
        Spark uses the `pickle` module to serialise the data and stores it in the temporary directory
        named spark.${USER}.cache where $USER is the currently logged-in user. This directory contains
        files per each project (that being a directory with the Spark.toml file at its root) whose
-       cache file is computed as the SHA512 hash of the current directory. As an example, if Spark
+       cache file is computed as the BLAKE2b hash of the current directory. As an example, if Spark
        is invoked from the directory /home/sophia/programming-projects/wisengine, its hash will be:
-       >> hashlib.sha512(b"/home/sophia/programming-projects/wisengine").hexdigest()
-       'bf328384a3d54da4908ad2d75b69bdb7864166d0b80c27c77f7b42ad559f25bf0cea69fb13b4c24c64aeceea479571b1f921334ae14b08fe20cace6320ba1041'"""
+       >> hashlib.blake2b(b"/home/sophia/programming-projects/wisengine", digest_size=16).hexdigest()
+       '499428c96aa2a349536a905b497bd9ec'"""
 
     def __init__(self, clear: bool = False):
         self.cache = b''
+        self.mapping: mmap.mmap | None = None
         self.clear = clear
         self.signature = b''
+        self.fingerprints = b''
         self.public_key_bytes = b''
-        self.username: str = getpass.getuser()
-        self.service = f"spark.{self.username}.cache"
+        self.private_key: Ed25519PrivateKey | None = None
         self.path: Path = get_temporary_cache_path()
         self.opened: bool = False
+        self.verified: bool = False
+        self.dirty: bool = False  # Tells if the cache was changed since it was last loaded or synced.
+
+    @classmethod
+    @functools.lru_cache(maxsize=1)
+    def get_keyring_identity(cls) -> tuple[str, str]:
+        """Finds the service and username the private key is kept under in the keyring, which are the same for
+           every cache file. The user is only looked up once a key is needed, since it can fail in environments
+           where no user can be resolved, such as some containers.
+           :return The service and the username of the private key in the keyring."""
+        username = getpass.getuser()
+        return f"spark.{username}.cache", username
 
     def __enter__(self) -> Self:
         return self.open()
@@ -53,86 +130,150 @@ class SparkCacheFile:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
 
+    def __generate_keys(self) -> None:
+        """Generates a new key pair, keeping the private key in the keyring and the public key on the filesystem."""
+        self.public_key_bytes, self.private_key = crypto.generate_key_pair()  # It also saves the public key.
+        kr.set_password(*self.get_keyring_identity(), crypto.stringify_private_key(self.private_key))
+
     def __load_public_key(self) -> bytes:
         """Loads an existing public key or generates a new one if it doesn't exist."""
-        public_key_path: Path = get_public_cache_key_path()
-        if not public_key_path.exists():
-            public_key_bytes, private_key = crypto.generate_key_pair()
-            kr.set_password(self.service, self.username, crypto.stringify_private_key(private_key))
-            with open(get_public_cache_key_path(), "wb") as public_key_file:
-                public_key_file.write(public_key_bytes)
-        else:
-            with open(get_public_cache_key_path(), "rb") as public_key_file:
-                public_key_bytes = public_key_file.read()
-        return public_key_bytes
+        try:
+            return get_public_cache_key_path().read_bytes()
+        except FileNotFoundError:
+            self.__generate_keys()
+            return self.public_key_bytes
+
+    def __load_private_key(self) -> Ed25519PrivateKey:
+        """Loads the private key from the keyring, or generates a new key pair if it's not there. Querying
+           the keyring is a round-trip to the system secret service, so we only do it the first time the
+           cache is signed, and keep the key for the lifetime of this object."""
+        if self.private_key is None:
+            private_key_pem: str = kr.get_password(*self.get_keyring_identity())
+            if private_key_pem is not None:
+                self.private_key = crypto.parse_private_key_string(private_key_pem)
+            if self.private_key is None:  # The key doesn't exist or is of the kind we no longer use.
+                self.__generate_keys()
+        return self.private_key
 
     def sync(self) -> None:
         """Writes the cache file back on the filesystem."""
-        private_key_pem: str = kr.get_password(self.service, self.username)
-        if private_key_pem is None:
-            public_key_bytes, private_key = crypto.generate_key_pair()
-            kr.set_password(self.service, self.username, crypto.stringify_private_key(private_key))
-            with open(get_public_cache_key_path(), "wb") as public_key_file:
-                public_key_file.write(public_key_bytes)
-        else:
-            private_key = crypto.parse_private_key_string(private_key_pem)
+        # Re-signing contents we haven't verified yet would legitimise whatever a third party put there.
+        self.__regenerate_if_cache_is_tampered()
+        private_key = self.__load_private_key()
+        self.__unmap()
         self.signature = crypto.sign(self.cache, private_key)
-        with open(self.path, "wb") as cache:
-            cache.write(self.signature)
-            cache.write(self.cache)
+        # The cache is written to a new file that then replaces the old one, rather than rewritten in place. Other
+        # instances, even in other Spark processes, may still have the old file mapped, and truncating it under
+        # them would crash them with SIGBUS, while the replaced file lives on until they unmap it.
+        fd, temporary_path = tempfile.mkstemp(prefix=f"{self.path.name}.", dir=self.path.parent)
+        try:
+            try:
+                writev_fully(fd, [self.fingerprints, self.signature, self.cache])
+            finally:
+                os.close(fd)
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        self.dirty = False
 
-    def regenerate(self) -> None:
+    def regenerate(self, fingerprints: list[tuple[int, int]] = None) -> None:
         """Reloads the cache by reading the build files normally and generating the cache for them.
            This is often the need if the cache file doesn't exit yet or was deleted. Upon completion
-           of this operation, the cache file is up and ready to be read."""
-        if not Path("Spark.toml").exists():
+           of this operation, the cache file is up and ready to be read.
+           :param fingerprints (optional) The fingerprints of the declaration files as returned by
+           _stat_declarations(), if they were just taken. Otherwise, the declaration files are statted."""
+        if fingerprints is None:
+            fingerprints = _stat_declarations()
+        # Spark.toml is one of the declarations, so whether it exists is already known from its fingerprint.
+        if fingerprints[SPARK_BUILD_DECLARATION_FILES.index(Path("Spark.toml"))] == (-1, -1):
             sys.stderr.write("spark: can't open Spark.toml: No such file or directory")
             sys.exit(codes.EXIT_SPARKFILE_UNAVAILABLE)
+        self.fingerprints = _pack_fingerprints(fingerprints)
         build = dict()
-        for declaration in SPARK_BUILD_DECLARATION_FILES:
-            if not declaration.exists():
+        for declaration, (mtime_ns, size) in zip(SPARK_BUILD_DECLARATION_FILES, fingerprints):
+            if size < 0:
                 continue
-            with open(declaration, "r") as declaration_file:
-                parsed_declaration: dict[str, Any] = tomllib.loads(declaration_file.read())
-                build = {**build, **parsed_declaration}
-        self.cache = pickle.dumps(build)
+            # Tables defined in several files are merged, so a file only needs to override the keys it changes.
+            for key, value in _parse_toml_cached(declaration, mtime_ns, size).items():
+                existing = build.get(key)
+                if isinstance(existing, dict) and isinstance(value, dict):
+                    build[key] = {**existing, **value}
+                else:
+                    build[key] = value
+        self.cache = pickle.dumps(build, PICKLE_PROTOCOL)
         self.opened = True
+        self.verified = True
+        self.dirty = True
         self.sync()  # We sync because we often expect an existing cache file to be available.
 
-    def __regenerate_cache_if_outdated(self) -> None:
-        """If any of the build files were changed since the last cache was updated, we regenerate it here."""
-        cache_file_modification_timestamp = os.path.getmtime(destinations.get_temporary_cache_path())
-        for declaration in SPARK_BUILD_DECLARATION_FILES:
-            if not declaration.exists():
-                continue
-            if os.path.getmtime(declaration) > cache_file_modification_timestamp:
-                self.regenerate()
+    def __load_or_regenerate(self, fingerprints: list[tuple[int, int]]) -> None:
+        """Loads the existing cache file, unless any of the build files were changed since it was generated,
+           in which case the cache is regenerated. The signature is not verified until the contents are used.
+           The file is memory-mapped, and the cache refers to the mapping directly rather than to a copy.
+           :param fingerprints The fingerprints of the declaration files as returned by _stat_declarations()."""
+        try:
+            fd = os.open(self.path, CACHE_FILE_READ_FLAGS)
+        except PermissionError:  # O_NOATIME is only allowed on our own files, which the cache file should be.
+            fd = os.open(self.path, CACHE_FILE_READ_FLAGS & ~getattr(os, "O_NOATIME", 0))
+        except FileNotFoundError:
+            os.makedirs(self.path.parent, OWNER_READ_AND_WRITE_ONLY_PERMISSION_MASK, True)
+            self.regenerate(fingerprints)
+            return
+        try:
+            if os.fstat(fd).st_size < PAYLOAD_OFFSET_BYTES:
+                self.regenerate(fingerprints)
+                return
+            mapping = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        if mapping[:DECLARATION_FINGERPRINTS_SIZE_BYTES] != self.fingerprints:
+            mapping.close()
+            self.regenerate(fingerprints)
+            return
+        self.mapping = mapping
+        self.signature = mapping[DECLARATION_FINGERPRINTS_SIZE_BYTES:PAYLOAD_OFFSET_BYTES]
+        self.cache = memoryview(mapping)[PAYLOAD_OFFSET_BYTES:]
+        self.verified = False
+
+    def __unmap(self) -> None:
+        """Releases the memory-mapped cache file, copying the cache out of it if it's still in use. This must
+           happen before the file is replaced, since Windows doesn't allow to replace mapped files."""
+        if self.mapping is None:
+            return
+        if isinstance(self.cache, memoryview):
+            view, self.cache = self.cache, bytearray(self.cache)
+            view.release()
+        self.mapping.close()
+        self.mapping = None
 
     def __regenerate_if_cache_is_tampered(self) -> None:
         """In case if the cache file was modified by a third party, we will verify whether
            the signature matches the content and reject the existing cache file but regenerate it."""
-        with open(self.path, "rb") as cache:
-            contents = cache.read()
-            self.signature = contents[:crypto.SIGNATURE_SIZE_BYTES]
-            self.cache = contents[crypto.SIGNATURE_SIZE_BYTES:]
-            if not crypto.verify(self.cache, self.signature, self.public_key_bytes):
-                self.regenerate()
+        if self.verified:
+            return
+        if crypto.verify(self.cache, self.signature, self.public_key_bytes):
+            self.verified = True
+        else:
+            self.regenerate()
 
     def open(self) -> Self:
         self.opened = True
         self.public_key_bytes = self.__load_public_key()
-        if not self.path.exists():
-            os.makedirs(self.path.parent, OWNER_READ_AND_WRITE_ONLY_PERMISSION_MASK, True)
-            self.regenerate()
-            return self
-        if self.clear:
+        fingerprints = _stat_declarations()
+        self.fingerprints = _pack_fingerprints(fingerprints)
+        if self.clear and self.path.exists():
+            self.verified = True  # The cache starts empty, and there is nothing on disk to trust.
+            self.dirty = True
             return self
-        self.__regenerate_cache_if_outdated()
-        self.__regenerate_if_cache_is_tampered()
+        self.__load_or_regenerate(fingerprints)
         return self
 
     def close(self):
-        self.sync()
+        # Signing and rewriting the cache is only worth it if it was changed, and it mostly isn't.
+        if self.dirty:
+            self.sync()
+        self.__unmap()
         self.opened = False
 
     def is_cached(self) -> bool:
@@ -140,9 +281,13 @@ class SparkCacheFile:
         :return True if there exists correctly signed cache file, and False otherwise."""
         if not self.opened:
             self.open()
-        if crypto.verify(self.cache, self.signature, self.public_key_bytes):
+        # The cache only needs to be verified once after it's loaded, since we trust our own changes to it.
+        if not self.verified:
+            self.verified = crypto.verify(self.cache, self.signature, self.public_key_bytes)
+        if self.verified:
             return True
-            # Since the cache file didn't pass the verification check, it's best to delete it.
+        # Since the cache file didn't pass the verification check, it's best to delete it.
+        self.__unmap()
         os.remove(self.path)
         return False
 
@@ -153,7 +298,9 @@ class SparkCacheFile:
            between bytes as meaningful data except for either pickling each request as an element of array or
            know the offsets ahead of time. Since cache files are often treated as a single meaningful unit,
            it makes more sense to read and write to it as so and if you need to add to cache, use append()."""
-        self.cache = pickle.dumps(data)
+        self.cache = pickle.dumps(data, PICKLE_PROTOCOL)
+        self.verified = True
+        self.dirty = True
 
     def append(self, data) -> int:
         """Appends the provided data to the cache. Normally, the cache file is treated as a single whole, and
@@ -163,8 +310,14 @@ class SparkCacheFile:
            append() should only be used when you read by known byte offsets.
            :param data The payload to append to the cache file.
            :return The size of the provided data in bytes."""
-        provision = pickle.dumps(data)
+        self.__regenerate_if_cache_is_tampered()
+        provision = pickle.dumps(data, PICKLE_PROTOCOL)
+        self.__unmap()
+        # Concatenating bytes copies the whole cache every time, while a bytearray grows in place.
+        if not isinstance(self.cache, bytearray):
+            self.cache = bytearray(self.cache)
         self.cache += provision
+        self.dirty = True
         return len(provision)
 
     def read(self, size: int = None, offset: int = 0):
@@ -177,9 +330,8 @@ class SparkCacheFile:
         if not self.opened:
             raise TypeError(f"A file was tried to be read from {self.path.name} but it was not open! "
                             f"Use the context manager: with SparkCacheFile() as cache")
-        if not self.path.exists():
-            self.regenerate()
-        if self.is_cached() and size is not None:
+        self.__regenerate_if_cache_is_tampered()
+        if size is not None:
             size += offset
             contents = self.cache[offset:size]
             return pickle.loads(contents)
@@ -1,64 +1,90 @@
 import os
 import sys
+import time
 import getpass
 import hashlib
+import functools
 from pathlib import Path
-from datetime import datetime
 
+# The platform family we run on, resolved once rather than by comparing sys.platform in every getter.
+# Other Unix-like systems follow the same conventions as Linux.
+PLATFORM: str = "darwin" if sys.platform.startswith("darwin") else "win" if sys.platform.startswith("win") else "linux"
 
+# The home directory of the user, looked up once rather than in the environment on every call. Unlike $HOME,
+# os.path.expanduser() also finds it on Windows and when the variable is not set.
+HOME: str = os.path.expanduser("~")
+
+# The directories relative to the home directory where the build logs are kept on each platform.
+BUILD_LOGGING_DIRECTORIES: dict[str, str] = {
+    "linux": ".local/share/spark",
+    "darwin": "Library/Logs/spark",
+    "win": "AppData/Local/spark/Logs",
+}
+
+
+@functools.lru_cache(maxsize=1)
 def get_temporary_directory() -> Path:
     """Seeks the preferred destination for temporary files on the host system."""
     TMP: str = "/tmp"
-    if sys.platform.startswith("darwin"):
+    if PLATFORM == "darwin":
         # While macOS also has /tmp, the $TMPDIR is more preferred destination to place temporary files.
         TMP = os.environ["TMPDIR"]
-    elif sys.platform.startswith("win"):
+    elif PLATFORM == "win":
         TMP = os.environ["TEMP"]
     return Path(TMP)
 
 
+@functools.lru_cache(maxsize=1)
 def get_public_cache_key_path() -> Path:
-    HOME: str = os.environ["HOME"]
-    if sys.platform.startswith("linux"):
-        return Path(HOME) / ".local" / "share" / "spark.public-key.pem"
-    elif sys.platform.startswith("darwin"):
-        return Path(HOME) / "Library" / "Application Support" / "spark.public-key.pem"
-    elif sys.platform.startswith("win"):
+    if PLATFORM == "linux":
+        return Path(f"{HOME}/.local/share/spark.public-key.pem")
+    elif PLATFORM == "darwin":
+        return Path(f"{HOME}/Library/Application Support/spark.public-key.pem")
+    elif PLATFORM == "win":
         APPDATA: str = os.environ["APPDATA"]
-        return Path(APPDATA) / "spark.public-key.pem"
+        return Path(f"{APPDATA}/spark.public-key.pem")
 
 
 def get_temporary_cache_path() -> Path:
     """Retrieves the path to the current cache file. Spark indexes different projects as absolute
        paths from the current working directory and constructs a hash for them stored in the 
        spark.USER.cache directory."""
+    return _get_project_cache_path(os.getcwdb())
+
+
+@functools.lru_cache(maxsize=1)
+def _get_project_cache_path(project_directory: bytes) -> Path:
+    """Computes the path to the cache file of the project in the given directory. The hash only needs to tell
+       projects apart rather than to be cryptographically strong, so we use a short BLAKE2b digest. The path is
+       remembered for the last directory, since the working directory rarely changes within one invocation."""
     USER: str = getpass.getuser()
     TMP: Path = get_temporary_directory()
-    project_file_hash: str = hashlib.sha512(os.getcwd().encode()).hexdigest()
-    return TMP / f"spark.{USER}.cache" / project_file_hash
+    project_file_hash: str = hashlib.blake2b(project_directory, digest_size=16).hexdigest()
+    return Path(f"{TMP}/spark.{USER}.cache/{project_file_hash}")
 
 
+@functools.lru_cache(maxsize=1)
 def get_user_preferences_file_path() -> Path:
     """Obtains the path to the user-specific configuration file. Spark expects it to define preferred
     toolchain and default options, such as the use of PCH, ramdisk and global caching."""
-    HOME: str = os.environ["HOME"]
-    if sys.platform.startswith("linux"):
-        return Path(HOME) / ".config" / "spark.preferences.toml"
-    elif sys.platform.startswith("darwin"):
-        return Path(HOME) / "Library" / "Preferences" / "spark.preferences.toml"
-    elif sys.platform.startswith("win"):
+    if PLATFORM == "linux":
+        return Path(f"{HOME}/.config/spark.preferences.toml")
+    elif PLATFORM == "darwin":
+        return Path(f"{HOME}/Library/Preferences/spark.preferences.toml")
+    elif PLATFORM == "win":
         LOCALAPPDATA: str = os.environ["LOCALAPPDATA"]
-        return Path(LOCALAPPDATA) / "spark.preferences.toml"
+        return Path(f"{LOCALAPPDATA}/spark.preferences.toml")
 
 
+@functools.lru_cache(maxsize=1)
 def get_environment_file_path() -> Path:
     """Obtains the path to the global system-wide metadata file. It is expected that it should include
     information about the machine running Spark (such as CPU details) and include a default toolchain."""
-    if sys.platform.startswith("linux"):
+    if PLATFORM == "linux":
         return Path("/etc/spark.environment.toml")
-    elif sys.platform.startswith("darwin"):
+    elif PLATFORM == "darwin":
         return Path("/Library/Preferences/spark.environment.toml")
-    elif sys.platform.startswith("win"):
+    elif PLATFORM == "win":
         return Path("C:\\ProgramData\\spark.environment.toml")
 
 
@@ -69,13 +95,8 @@ def get_build_logging_path() -> Path:
        project name. This distinction helps to avoid polluting filenames, give additional
        information to users when the build started and is granular enough to avoid collisions.
        :return The path to the log file."""
-    parts = Path(os.getcwd()).parts
-    parent = parts[len(parts) - 1]
-    HOME: str = os.path.expanduser("~")
-    day, hour = datetime.now().strftime("%d.%m.%Y %H:%M").split()
-    base_path = Path(HOME) / ".local" / "share" / "spark"
-    if sys.platform.startswith("win"):
-        base_path = Path(HOME) / "AppData" / "Local" / "spark" / "Logs"
-    elif sys.platform.startswith("darwin"):
-        base_path = Path(HOME) / "Library" / "Logs" / "spark"
-    return base_path / day / hour / f"{parent}.log"
+    parent = os.path.basename(os.getcwd())
+    now = time.localtime()
+    day = f"{now.tm_mday:02d}.{now.tm_mon:02d}.{now.tm_year}"
+    hour = f"{now.tm_hour:02d}:{now.tm_min:02d}"
+    return Path(f"{HOME}/{BUILD_LOGGING_DIRECTORIES[PLATFORM]}/{day}/{hour}/{parent}.log")
@@ -17,3 +17,28 @@ def perror(message: str, exception: OSError, code: int = 0) -> None:
     sys.stderr.write("spark: " + message + ": " + errno_message + '\n')
     if code != 0:
         sys.exit(code)
+
+
+def write_fully(fd: int, data: bytes) -> None:
+    """Writes the whole data to the file descriptor. os.write() may write less than asked
+       if it's interrupted by a signal, in which case we write the rest of it again."""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def writev_fully(fd: int, buffers: list[bytes]) -> None:
+    """Writes all buffers to the file descriptor one after another, with a single system call where possible.
+       Like os.write(), os.writev() may write less than asked, for example for very large buffers, in which
+       case we write the rest of the buffers one by one. Where there is no os.writev(), such as on Windows,
+       the buffers are joined and written at once."""
+    if not hasattr(os, "writev"):
+        write_fully(fd, b"".join(buffers))
+        return
+    written = os.writev(fd, buffers)
+    for buffer in buffers:
+        if written >= len(buffer):
+            written -= len(buffer)
+            continue
+        write_fully(fd, memoryview(buffer)[written:])
+        written = 0
@@ -4,30 +4,82 @@ import sys
 from pathlib import Path
 
 from spark.codes import EXIT_TEE_NO_LOGFILE
+from spark.lib import write_fully
 
 EOF = b"__EOF__\n"
 
+# The amount of bytes to read from the pipe at once. It's the default pipe capacity on Linux.
+PIPE_BUFFER_SIZE = 65536
 
-def main():
+
+def pump(source: int, destination: int, log: int) -> None:
+    """Copies everything read from the source file descriptor to both the destination and the log file
+       descriptors. It's the in-process counterpart of main() used by spark.builder.BuildProcessExecutor,
+       and it returns once the source reaches the end of file, that is, all of its write ends are closed.
+       :param source The file descriptor to read from, usually the read end of a pipe.
+       :param destination The file descriptor to copy the output to, usually the original standard output.
+       :param log The file descriptor of the log file to write the output to."""
+    while chunk := os.read(source, PIPE_BUFFER_SIZE):
+        write_fully(destination, chunk)
+        write_fully(log, chunk)
+
+
+def relay(source: int, destination: int, log: int) -> None:
+    """Copies everything read from the source file descriptor to both the destination and the log file
+       descriptors until either the source reaches the end of file or the EOF line is read from it. The
+       source is read in blocks rather than lines, so the EOF line is searched for at the start of every
+       line of the block. If a block ends with what could be the beginning of the EOF line, it's held
+       back until the next block tells if it was one.
+       :param source The file descriptor to read from, usually the standard input.
+       :param destination The file descriptor to copy the output to, usually the standard output.
+       :param log The file descriptor of the log file to write the output to."""
+    held = b""
+    line_start = True  # Tells if the data read next starts a new line.
+    while chunk := os.read(source, PIPE_BUFFER_SIZE):
+        data = held + chunk
+        if line_start and data.startswith(EOF):
+            return
+        index = data.find(b"\n" + EOF)
+        if index >= 0:
+            write_fully(destination, data[:index + 1])
+            write_fully(log, data[:index + 1])
+            return
+        suffix_start = data.rfind(b"\n") + 1
+        suffix = data[suffix_start:]
+        if (suffix_start > 0 or line_start) and suffix and EOF.startswith(suffix):
+            data, held = data[:suffix_start], suffix
+        else:
+            held = b""
+        if data:
+            write_fully(destination, data)
+            write_fully(log, data)
+            line_start = data.endswith(b"\n")
+    write_fully(destination, held)
+    write_fully(log, held)
+
+
+def main(argv: list[str] = None, source: int = None, destination: int = None) -> None:
     """Emulates the Unix tee(1) command. We use it to be able to capture the standard output
        of build processes and write them to a log file, including any output child processes
        make. The provided solution is cross-platform and works by duplicating stdout and stderr
        to a shared pipe where processes are writing to and the tee.py process reads from it,
        writes the content to regular standard output and the log file as specified in the second
-       command-line argument."""
-    if len(sys.argv) < 2:
+       command-line argument.
+       :param argv (optional) The command-line arguments, including the program name. Defaults to sys.argv.
+       :param source (optional) The file descriptor to read from. Defaults to the standard input.
+       :param destination (optional) The file descriptor to copy the output to. Defaults to the standard output."""
+    argv = sys.argv if argv is None else argv
+    if len(argv) < 2:
         sys.stderr.write("tee.py: output argument not specified.\n")
         sys.exit(EXIT_TEE_NO_LOGFILE)
-    log_path = Path(sys.argv[1])
+    log_path = Path(argv[1])
     if not log_path.exists():
         os.makedirs(log_path.parent, exist_ok=True)
-    with open(log_path, "wb") as log:
-        for line in sys.stdin.buffer:
-            if line == EOF:
-                break
-            sys.stdout.buffer.write(line)
-            sys.stdout.buffer.flush()
-            log.write(line)
+    source = sys.stdin.fileno() if source is None else source
+    destination = sys.stdout.fileno() if destination is None else destination
+    # The output is copied in blocks with a single write for each, so there is nothing to buffer.
+    with open(log_path, "wb", buffering=0) as log:
+        relay(source, destination, log.fileno())
 
 
 if __name__ == "__main__":
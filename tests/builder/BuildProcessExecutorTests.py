@@ -1,4 +1,5 @@
 import os.path
+import shutil
 import subprocess
 
 
@@ -7,6 +8,7 @@ import pytest
 
 from spark.destinations import get_build_logging_path
 from spark.builder import BuildProcessExecutor
+from spark.builder.BuildProcessExecutor import PIDFD_SUPPORTED
 
 
 def test_pings():
@@ -45,6 +47,15 @@ def test_progress():
         assert total == 3
 
 
+def test_refills_vacant_jobs():
+    with BuildProcessExecutor(6, jobs=2) as executor:
+        for command in [["ping", "-c", "1", "www.cloudflare.com"]] * 6:
+            executor.submit(command)
+        completed = [code for pid, code in executor.as_completed()]
+        assert completed == [0] * 6
+        assert executor.is_work_complete()
+
+
 def test_empty_work():
     with BuildProcessExecutor(3) as executor:
         for pid, code in executor.as_completed():
@@ -72,11 +83,26 @@ def test_loging():
     with BuildProcessExecutor(3) as executor:
         for command in [["ping", "-c", "3", "www.cloudflare.com"]] * 3:
             executor.submit(command)
-    with open(get_build_logging_path(), "r") as logfile:
-        log_contents = logfile.read()
-        assert log_contents == ("[1/3] ping -c 3 www.cloudflare.com\n"
-                                "[2/3] ping -c 3 www.cloudflare.com\n"
-                                "[3/3] ping -c 3 www.cloudflare.com\n")
+    log_contents = get_build_logging_path().read_text()
+    assert log_contents == ("[1/3] ping -c 3 www.cloudflare.com\n"
+                            "[2/3] ping -c 3 www.cloudflare.com\n"
+                            "[3/3] ping -c 3 www.cloudflare.com\n")
+
+
+def test_quiet_logging():
+    with BuildProcessExecutor(1, quiet=True) as executor:
+        executor.submit(["ping", "-c", "1", "www.cloudflare.com"])
+    assert "[1/1]" not in get_build_logging_path().read_text()
+
+
+@pytest.mark.skipif(not PIDFD_SUPPORTED, reason="the selector is only used with pidfds")
+def test_shutdown_closes_selector():
+    with BuildProcessExecutor(1, quiet=True) as executor:
+        selector = executor.selector
+        executor.submit(["ping", "-c", "1", "www.cloudflare.com"])
+    # A closed selector drops its map along with the descriptor it holds.
+    assert selector.get_map() is None
+    assert executor.selector is None
 
 
 def test_stdout_redirection():
@@ -92,3 +118,43 @@ def test_stdout_redirection():
         head = logfile.read(redirected_content_length)
         assert head == redirected_content
         assert os.path.getsize(logfile_path) > redirected_content_length
+
+
+def test_estimate_cost():
+    executor = BuildProcessExecutor(3, timings={"main.c": 2.5})
+    assert executor.estimate_cost(["cc", "-c", "main.c", "-o", "main.o"]) == 2.5
+    assert executor.estimate_cost(["cc", "-c", __file__ + ".c"]) == 0.0
+    assert executor.estimate_cost(["cc", "main.o", "-o", "main"]) == 0.0
+
+
+def test_estimate_cost_of_untimed_source(tmp_path):
+    timed_source, untimed_source = tmp_path / "timed.c", tmp_path / "untimed.c"
+    timed_source.write_bytes(b"\n" * 1000)
+    untimed_source.write_bytes(b"\n" * 3000)
+    executor = BuildProcessExecutor(3, timings={str(timed_source): 2.0})
+    # The untimed source is estimated at the rate the timed one was compiled, so that both are in seconds.
+    assert executor.estimate_cost(["cc", "-c", str(untimed_source)]) == pytest.approx(6.0)
+
+
+@pytest.mark.parametrize("load_average, expected_order", [
+    (0.0, ["long.c", "medium.c", "short.c"]),
+    # When the system is overloaded, the executor drops to a single job and clears the queue shortest first.
+    (100.0, ["short.c", "medium.c", "long.c"]),
+])
+def test_dispatch_order(load_average, expected_order, monkeypatch, capfd):
+    monkeypatch.setattr(os, "getloadavg", lambda: (load_average,) * 3, raising=False)
+    executor = BuildProcessExecutor(3, jobs=2, load_average=1.0,
+                                    timings={"short.c": 1.0, "medium.c": 2.0, "long.c": 3.0})
+    for source in ["medium.c", "short.c", "long.c"]:
+        executor.submit(["true", source])
+    for _ in executor.as_completed():
+        pass
+    executor.shutdown()
+    dispatched = [line.split()[-1] for line in capfd.readouterr().out.splitlines()]
+    assert dispatched == expected_order
+
+
+def test_resolve_executable():
+    executor = BuildProcessExecutor(1)
+    assert executor.resolve_executable("sh") == shutil.which("sh")
+    assert executor.resolve_executable("no-such-program") == "no-such-program"
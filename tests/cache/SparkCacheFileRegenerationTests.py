@@ -0,0 +1,38 @@
+import os
+from pathlib import Path
+
+import pytest
+import keyring as kr
+
+from spark import codes
+from spark import destinations
+from spark.cache import SparkCacheFile
+
+# These tests start over with a new cache or key pair, so they are kept apart from the ones that reuse them.
+pytestmark = pytest.mark.usefixtures("primed_cache")
+
+
+def test_sync_regenerates_key_pair_if_does_not_exist():
+    public_key = destinations.get_public_cache_key_path().read_text()
+    kr.delete_password(*SparkCacheFile.get_keyring_identity())
+    with SparkCacheFile() as cache:
+        cache.sync()
+    regenerated_public_key = destinations.get_public_cache_key_path().read_text()
+    # Public keys must be cryptographically bonded with their private counterpart, hence
+    # deleting the private key must regenerate the whole pair and save a new public key.
+    assert public_key != regenerated_public_key
+
+
+@pytest.mark.usefixtures("delete_cache_if_exists")
+def test_regenerate_fails_without_spark_toml():
+    Spark = Path("Spark.toml")
+    os.makedirs(".tmp", exist_ok=True)
+    Spark = Spark.rename(".tmp/Spark.toml")
+    # Spark.toml is put back even if the test fails, since every other test relies on it.
+    try:
+        with pytest.raises(SystemExit) as mock_exit:
+            with SparkCacheFile() as cache:
+                pass
+    finally:
+        Spark.rename("Spark.toml")
+    assert mock_exit.value.code == codes.EXIT_SPARKFILE_UNAVAILABLE
@@ -1,23 +1,29 @@
 import os
+import mmap
 import pickle
+import shutil
 import tomllib
 from pathlib import Path
 
 import pytest
 import toml
-import keyring as kr
 
-from spark import codes
 from spark import destinations
 from spark.cache import crypto
 from spark.cache import SparkCacheFile
+from spark.cache.SparkCacheFile import DECLARATION_FINGERPRINTS_SIZE_BYTES, PAYLOAD_OFFSET_BYTES, _parse_toml_cached
+from tests.cache.conftest import CACHE_PATH
 
-CACHE_PATH = destinations.get_temporary_cache_path()
+# The cache and the key pair are created once for the whole module, and only the tests of regeneration start over.
+pytestmark = pytest.mark.usefixtures("primed_cache")
 
 
-def delete_cache_if_exists():
-    if os.path.exists(CACHE_PATH):
-        os.remove(CACHE_PATH)
+def map_cache_file() -> mmap.mmap:
+    fd = os.open(CACHE_PATH, os.O_RDONLY)
+    try:
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
 
 
 def test_not_opened_file():
@@ -26,23 +32,18 @@ def test_not_opened_file():
         contents = cache.read()
 
 
+@pytest.mark.usefixtures("delete_cache_if_exists")
 def test_regenerate_cache():
-    delete_cache_if_exists()
     with SparkCacheFile() as cache:
         assert cache.read() is not None
 
 
-def test_signature_insertion():
-    delete_cache_if_exists()
+def test_signature_insertion(public_key_bytes):
     with SparkCacheFile() as cache:
         pass
-    with open(destinations.get_public_cache_key_path(), "rb") as public_key_file:
-        public_key = public_key_file.read()
-    with open(CACHE_PATH, "rb") as cache_file:
-        contents = cache_file.read()
-        signature = contents[:crypto.SIGNATURE_SIZE_BYTES]
-        payload = contents[crypto.SIGNATURE_SIZE_BYTES:]
-    assert crypto.verify(payload, signature, public_key)
+    with map_cache_file() as mapping, memoryview(mapping) as contents:
+        signature = bytes(contents[DECLARATION_FINGERPRINTS_SIZE_BYTES:PAYLOAD_OFFSET_BYTES])
+        assert crypto.verify(contents[PAYLOAD_OFFSET_BYTES:], signature, public_key_bytes)
 
 
 def test_writeback_and_depickling():
@@ -55,51 +56,45 @@ def test_writeback_and_depickling():
 
 
 def test_append_payload():
-    delete_cache_if_exists()
     with SparkCacheFile() as cache:
         defaults = cache.read()
         defaults_size = cache.get_cache_size()
         additional_payload = ["clang++", "-D_GNU_SOURCE", "-fno-exceptions", "-flto", "main.cc", "-o", "main"]
         additional_payload_size = cache.append(additional_payload)
-    with SparkCacheFile() as cache:
         actual_defaults = cache.read(defaults_size)
         actual_additional_payload = cache.read(additional_payload_size, defaults_size)
     assert actual_defaults == defaults
     assert additional_payload == actual_additional_payload
+    # The appended payload is signed and written on close, and read back from the mapped file at its offset.
+    with SparkCacheFile() as cache:
+        assert cache.read(defaults_size) == defaults
+        assert cache.read(additional_payload_size, defaults_size) == additional_payload
+
+
+def test_sync_keeps_other_instances_mapping():
+    payload = ["clang", "-c", "main.c"] * 100000
+    with SparkCacheFile(clear=True) as cache:
+        cache.write(payload)
+    with SparkCacheFile() as mapped_cache:
+        # A smaller cache written meanwhile must not pull the mapped file from under the first instance.
+        with SparkCacheFile(clear=True) as cache:
+            cache.write(["gcc"])
+        assert mapped_cache.read() == payload
 
 
 def test_sync():
-    delete_cache_if_exists()
     with SparkCacheFile() as cache:
         payload = ["gcc", "main.c", "-o", "main", "-lcheck"]
         cache.write(payload)
         cache.sync()
-        with open(destinations.get_temporary_cache_path(), "rb") as cache_file:
-            contents = cache_file.read()
-            synced_payload = contents[crypto.SIGNATURE_SIZE_BYTES:]
-            assert pickle.dumps(payload) == synced_payload
-
-
-def test_sync_regenerates_key_pair_if_does_not_exist():
-    with open(destinations.get_public_cache_key_path(), "r") as public_key_file:
-        public_key = public_key_file.read()
-    with SparkCacheFile() as cache:
-        service = cache.service
-        username = cache.username
-    kr.delete_password(service, username)
-    with SparkCacheFile() as cache:
-        pass
-    with open(destinations.get_public_cache_key_path(), "r") as public_key_file:
-        regenerated_public_key = public_key_file.read()
-    # Public keys must be cryptographically bonded with their private counterpart, hence
-    # deleting the private key must regenerate the whole pair and save a new public key.
-    assert public_key != regenerated_public_key
+        with map_cache_file() as mapping, memoryview(mapping) as contents:
+            assert pickle.dumps(payload, pickle.HIGHEST_PROTOCOL) == contents[PAYLOAD_OFFSET_BYTES:]
 
 
 def test_regenerates_successfully():
-    with open("Spark.toml", "r+") as sparkfile:
-        contents = tomllib.loads(sparkfile.read())
-        contents["package"]["name"] = "Spark++"
+    with open("Spark.toml", "rb") as sparkfile:
+        contents = tomllib.load(sparkfile)
+    contents["package"]["name"] = "Spark++"
     with open("Spark.toml", "w") as sparkfile:
         toml.dump(contents, sparkfile)
     with SparkCacheFile() as cache:
@@ -107,40 +102,85 @@ def test_regenerates_successfully():
         assert contents["package"]["name"] == "Spark++"
 
 
+def test_merges_tables_across_declarations():
+    patch = Path("spark.patch.toml")
+    patch.write_text('[spark]\npch = true\n')
+    try:
+        with SparkCacheFile() as cache:
+            contents = cache.read()
+    finally:
+        patch.unlink()
+    assert contents["spark"]["pch"]
+    assert contents["spark"]["sources"] == "src/**"
+
+
+def test_parse_cache_follows_working_directory(tmp_path, monkeypatch):
+    # Both declarations have the same relative path, size and modification time, and only differ by the directory.
+    for name in ("one", "two"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "Spark.toml").write_text(f'[package]\nname = "{name}"\n')
+    parsed_names = []
+    for name in ("one", "two"):
+        monkeypatch.chdir(tmp_path / name)
+        declaration = Path("Spark.toml")
+        parsed_declaration = _parse_toml_cached(declaration, 0, declaration.stat().st_size)
+        parsed_names.append(parsed_declaration["package"]["name"])
+    assert parsed_names == ["one", "two"]
+
+
+@pytest.mark.usefixtures("delete_cache_if_exists")
 def test_regenerate_cache_directory():
-    delete_cache_if_exists()
     cache_directory: Path = destinations.get_temporary_cache_path().parent
-    os.removedirs(cache_directory)
+    shutil.rmtree(cache_directory, ignore_errors=True)
     with SparkCacheFile() as cache:
         assert cache_directory.exists()
 
 
+def test_close_keeps_unchanged_cache():
+    with SparkCacheFile() as cache:
+        cache.read()
+    before = os.stat(CACHE_PATH)
+    with SparkCacheFile() as cache:
+        cache.read()
+    after = os.stat(CACHE_PATH)
+    # Ed25519 signatures are deterministic, so the contents would be the same even if the cache was synced again.
+    # Syncing replaces the file though, so it can be told from the inode and the modification time.
+    assert after.st_ino == before.st_ino
+    assert after.st_mtime_ns == before.st_mtime_ns
+
+
+def test_regenerates_tampered_cache(pristine_cache):
+    shutil.copyfile(pristine_cache, CACHE_PATH)
+    with SparkCacheFile() as cache:
+        defaults = cache.read()
+        cache.write(["gcc", "main.c", "-o", "main"])
+    with open(CACHE_PATH, "r+b") as cache_file:
+        cache_file.seek(PAYLOAD_OFFSET_BYTES)
+        cache_file.write(pickle.dumps({"tampered": True}))
+    with SparkCacheFile() as cache:
+        assert cache.read() == defaults
+
+
 def test_is_cached_if_opened():
-    delete_cache_if_exists()
     with SparkCacheFile() as cache:
         cache_status = cache.is_cached()
         assert cache_status
 
 
+def test_is_not_cached_if_tampered():
+    with SparkCacheFile() as cache:
+        pass
+    with open(CACHE_PATH, "r+b") as cache_file:
+        cache_file.seek(PAYLOAD_OFFSET_BYTES)
+        cache_file.write(pickle.dumps({"tampered": True}))
+    with SparkCacheFile() as cache:
+        assert not cache.is_cached()
+    assert not CACHE_PATH.exists()
+
+
 def test_is_cached_after_sync():
-    delete_cache_if_exists()
     with SparkCacheFile() as cache:
         pass
     with SparkCacheFile() as cache:
         cache_status = cache.is_cached()
         assert cache_status
-
-
-# Note: this test is placed the last one because it manipulates the local Spark.toml file
-# at the current directory. It's somewhat annoying when a number of tests fail just because
-# it failed and didn't move it from the .tmp directory, that's why we run it the last.
-def test_regenerate_fails_without_spark_toml():
-    delete_cache_if_exists()
-    Spark = Path("Spark.toml")
-    os.makedirs(".tmp", exist_ok=True)
-    Spark = Spark.rename(".tmp/Spark.toml")
-    with pytest.raises(SystemExit) as mock_exit:
-        with SparkCacheFile() as cache:
-            pass
-    assert mock_exit.value.code == codes.EXIT_SPARKFILE_UNAVAILABLE
-    Spark.rename("Spark.toml")
@@ -0,0 +1,71 @@
+import shutil
+
+import pytest
+import keyring as kr
+from keyring.backend import KeyringBackend
+from keyring.errors import PasswordDeleteError
+
+from spark import destinations
+from spark.cache import crypto
+from spark.cache import SparkCacheFile
+
+CACHE_PATH = destinations.get_temporary_cache_path()
+
+
+class MemoryKeyring(KeyringBackend):
+    """Keeps the passwords in memory, so that the tests don't depend on or talk to the system keyring."""
+    priority = 1
+
+    def __init__(self):
+        super().__init__()
+        self.passwords: dict[tuple[str, str], str] = {}
+
+    def get_password(self, service: str, username: str) -> str | None:
+        return self.passwords.get((service, username))
+
+    def set_password(self, service: str, username: str, password: str) -> None:
+        self.passwords[(service, username)] = password
+
+    def delete_password(self, service: str, username: str) -> None:
+        if self.passwords.pop((service, username), None) is None:
+            raise PasswordDeleteError("Password not found")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def memory_keyring():
+    original_keyring = kr.get_keyring()
+    kr.set_keyring(MemoryKeyring())
+    yield
+    kr.set_keyring(original_keyring)
+
+
+@pytest.fixture(scope="session")
+def key_pair():
+    return crypto.generate_key_pair()
+
+
+@pytest.fixture(scope="session")
+def primed_cache():
+    # Signing the cache also makes sure the private key is in the keyring, which starts empty every session.
+    with SparkCacheFile() as cache:
+        cache.sync()
+
+
+@pytest.fixture
+def delete_cache_if_exists():
+    CACHE_PATH.unlink(missing_ok=True)
+
+
+@pytest.fixture(scope="session")
+def public_key_bytes(primed_cache):
+    return destinations.get_public_cache_key_path().read_bytes()
+
+
+@pytest.fixture(scope="session")
+def pristine_cache(tmp_path_factory, primed_cache):
+    CACHE_PATH.unlink(missing_ok=True)
+    with SparkCacheFile():
+        pass
+    pristine_cache_path = tmp_path_factory.mktemp("spark") / "cache"
+    shutil.copyfile(CACHE_PATH, pristine_cache_path)
+    return pristine_cache_path
@@ -2,10 +2,37 @@ import pickle
 
 import keyring as kr
 from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
 
 from spark.cache import crypto
 from spark.destinations import get_public_cache_key_path
 
+PAYLOAD = {
+    "package": {
+        "name": "ImageBuilder",
+        "version": "2.3.5",
+        "license": "MIT",
+        "authors": ["Andrew Sweet <andrew-sweet@gmail.com", "Nikolas Tree <nictree@protonmail.com"],
+        "description": "A simple and intuitive to use library for dynamically creating pictures"
+    },
+    "dependencies": {
+        "fmt": "^2.3.4",
+        "ImageMagick": "^7.1.1"
+    },
+    "dev-dependencies": {
+        "check": {
+            "version": "^0.32",
+            "macro": "LIBCHECK"
+        }
+    },
+    "image-builder": {
+        "sources": "src/builder/**",
+        "lto": "thin",
+        "strip": "all-unneeded"
+    }
+}
+PAYLOAD_BYTES: bytes = pickle.dumps(PAYLOAD, pickle.HIGHEST_PROTOCOL)
+
 
 def test_generate_key_pair():
     supplied_public_key, private_key = crypto.generate_key_pair()
@@ -18,44 +45,38 @@ def test_generate_key_pair():
 
 def test_save_public_key():
     generated_public_key, private_ley = crypto.generate_key_pair()
-    with open(get_public_cache_key_path(), "rb") as saved_public_key:
-        assert generated_public_key == saved_public_key.read()
+    assert generated_public_key == get_public_cache_key_path().read_bytes()
 
 
-def test_save_private_key():
-    generated_public_key, private_key = crypto.generate_key_pair()
+def test_save_private_key(key_pair):
+    generated_public_key, private_key = key_pair
     original_private_key_string = crypto.stringify_private_key(private_key)
     kr.set_password("crypto.service", "user", original_private_key_string)
     provided_private_key_string = kr.get_password("crypto.service", "user")
     assert provided_private_key_string == original_private_key_string
 
 
-def test_verify_payload():
-    payload = {
-        "package": {
-            "name": "ImageBuilder",
-            "version": "2.3.5",
-            "license": "MIT",
-            "authors": ["Andrew Sweet <andrew-sweet@gmail.com", "Nikolas Tree <nictree@protonmail.com"],
-            "description": "A simple and intuitive to use library for dynamically creating pictures"
-        },
-        "dependencies": {
-            "fmt": "^2.3.4",
-            "ImageMagick": "^7.1.1"
-        },
-        "dev-dependencies": {
-            "check": {
-                "version": "^0.32",
-                "macro": "LIBCHECK"
-            }
-        },
-        "image-builder": {
-            "sources": "src/builder/**",
-            "lto": "thin",
-            "strip": "all-unneeded"
-        }
-    }
-    payload_bytes: bytes = pickle.dumps(payload)
-    public_key_bytes, private_key = crypto.generate_key_pair()
-    signature: bytes = crypto.sign(payload_bytes, private_key)
-    assert crypto.verify(payload_bytes, signature, public_key_bytes)
+def test_verify_payload(key_pair):
+    public_key_bytes, private_key = key_pair
+    signature: bytes = crypto.sign(PAYLOAD_BYTES, private_key)
+    assert crypto.verify(memoryview(PAYLOAD_BYTES), signature, public_key_bytes)
+
+
+def test_signature_size(key_pair):
+    public_key_bytes, private_key = key_pair
+    assert len(crypto.sign(b"payload", private_key)) == crypto.SIGNATURE_SIZE_BYTES
+
+
+def test_rejects_rsa_keys():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_key_string = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    ).decode()
+    assert crypto.parse_private_key_string(private_key_string) is None
+    public_key_bytes = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    assert not crypto.verify(b"payload", b"\0" * crypto.SIGNATURE_SIZE_BYTES, public_key_bytes)
@@ -1,10 +1,9 @@
 import os
 import shutil
 import subprocess as sb
-import string
-import random
 import sys
 import time
+import threading
 from pathlib import Path
 
 from spark import codes
@@ -13,39 +12,77 @@ from spark.lib import tee
 PYTHON_EXECUTABLE = sys.executable or shutil.which("python3")
 
 
+def wait_for_size(path: Path, size: int, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if os.path.getsize(path) >= size:
+                return
+        except FileNotFoundError:
+            pass  # tee hasn't created it yet.
+        time.sleep(0.01)
+
+
 def test_error_if_no_output_file():
-    tee_process = sb.run([PYTHON_EXECUTABLE, tee.__file__])
+    tee_process = sb.run([PYTHON_EXECUTABLE, tee.__file__], stdin=sb.DEVNULL, stdout=sb.DEVNULL, stderr=sb.DEVNULL)
     assert tee_process.returncode == codes.EXIT_TEE_NO_LOGFILE
 
 
-def test_create_directories():
-    letters = string.ascii_lowercase
-    directory = ''.join(random.choice(letters) for _ in range(15))
-    parents = [Path(parent) for parent in directory.split('a')]
-    path = Path()
-    for parent in parents:
-        path /= parent
-    path /= "output.log"
-    tee_process = sb.run([PYTHON_EXECUTABLE, tee.__file__, path])
+def test_create_directories(tmp_path):
+    path = tmp_path / "a" / "b" / "c" / "output.log"
+    pipe_read_fd, pipe_write_fd = os.pipe()
+    os.close(pipe_write_fd)
+    tee.main(["tee.py", path], pipe_read_fd)
+    os.close(pipe_read_fd)
     assert path.exists()
-    assert tee_process.returncode == 0
-    shutil.rmtree(path.parent)
 
 
-def test_output_logfile():
+def test_output_logfile(tmp_path):
     LOG1 = b"This should be logged to the output.log file from tee.py.\n"
     LOG2 = b"Even more output that goes through tee.py.\n"
+    log_path = tmp_path / "output.log"
     pipe_read_fd, pipe_write_fd = os.pipe()
+    destination = os.open(os.devnull, os.O_WRONLY)
     os.write(pipe_write_fd, LOG1)
-    tee_process = sb.Popen([PYTHON_EXECUTABLE, tee.__file__, "output.log"], stdin=pipe_read_fd)
-    time.sleep(1)
-    with open("output.log", "rb") as logfile:
-        assert logfile.read() == LOG1
+    tee_thread = threading.Thread(target=tee.main, args=(["tee.py", log_path], pipe_read_fd, destination))
+    tee_thread.start()
+    wait_for_size(log_path, len(LOG1))
+    assert log_path.read_bytes() == LOG1
     os.write(pipe_write_fd, LOG2)
-    time.sleep(1)
-    with open("output.log", "rb") as logfile:
-        combined_contents = LOG1 + LOG2
-        assert logfile.read() == combined_contents
-    tee_process.terminate()
-    tee_process.wait()
-    os.remove("output.log")
+    wait_for_size(log_path, len(LOG1 + LOG2))
+    assert log_path.read_bytes() == LOG1 + LOG2
+    os.close(pipe_write_fd)
+    tee_thread.join()
+    for fd in (pipe_read_fd, destination):
+        os.close(fd)
+
+
+def test_pump(tmp_path):
+    OUTPUT = b"Compiling main.c\nwarning: unused variable 'x'\n"
+    source_read_fd, source_write_fd = os.pipe()
+    destination_read_fd, destination_write_fd = os.pipe()
+    os.write(source_write_fd, OUTPUT)
+    os.close(source_write_fd)
+    log_path = tmp_path / "pump.log"
+    log = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    tee.pump(source_read_fd, destination_write_fd, log)
+    os.close(log)
+    assert os.read(destination_read_fd, len(OUTPUT) + 1) == OUTPUT
+    assert log_path.read_bytes() == OUTPUT
+    for fd in (source_read_fd, destination_read_fd, destination_write_fd):
+        os.close(fd)
+
+
+def test_relay_stops_at_eof(tmp_path):
+    OUTPUT = b"Linking main\n__EOF__ is only the end on its own line\n"
+    source_read_fd, source_write_fd = os.pipe()
+    destination_read_fd, destination_write_fd = os.pipe()
+    os.write(source_write_fd, OUTPUT + tee.EOF + b"Never copied\n")
+    log_path = tmp_path / "relay.log"
+    log = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    tee.relay(source_read_fd, destination_write_fd, log)
+    os.close(log)
+    assert os.read(destination_read_fd, len(OUTPUT) + 1) == OUTPUT
+    assert log_path.read_bytes() == OUTPUT
+    for fd in (source_read_fd, source_write_fd, destination_read_fd, destination_write_fd):
+        os.close(fd)
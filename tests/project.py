@@ -9,6 +9,6 @@ def test_init_new_default_project():
     assert os.path.isdir(project_name)
     sparkfile = Path(project_name) / Path("Spark.toml")
     assert os.path.isfile(sparkfile)
-    payload = tomllib.loads(sparkfile.open().read())
+    payload = tomllib.loads(sparkfile.read_text())
     assert payload["package"]["name"] == "Spark"
     assert payload["package"]["version"] == "0.0.1-rc"